@@ -5,20 +5,31 @@ Console("Lat15-Terminus12x6")
 print("Importing modules (this may take a while)...")
 import time
 t1 = time.perf_counter()
+import errno
+import gzip
+import hashlib
+import hmac
 import json
+import mimetypes
 import os
+import struct
 import subprocess
 import time
 import traceback
-from base64 import b64decode
+import warnings
+from base64 import b64decode, b64encode
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from shutil import which
 from socket import gethostname
-from threading import Thread, Lock
 
 import tornado.ioloop
 import tornado.options
+import tornado.queues
 import tornado.web
 import tornado.websocket
+from tornado.iostream import StreamClosedError
+from ev3dev2 import DeviceNotFound
 from ev3dev2.led import Leds
 from ev3dev2.motor import list_motors, Motor, MoveJoystick, OUTPUT_B, OUTPUT_C
 from ev3dev2.sensor import list_sensors, Sensor
@@ -26,9 +37,125 @@ t2 = time.perf_counter()
 print("Imported in", t2-t1)
 
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import bcrypt
+except ImportError:
+    bcrypt = None
+try:
+    from passlib.hash import apr_md5_crypt
+except ImportError:
+    apr_md5_crypt = None
+try:
+    import pyudev
+except ImportError:
+    pyudev = None
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+
+if orjson is not None:
+    # orjson is a lot faster than json and directly returns UTF-8 encoded bytes
+    json_dumps = orjson.dumps
+    json_loads = orjson.loads
+else:
+    def json_dumps(obj):
+        return json.dumps(obj).encode("utf-8")
+    json_loads = json.loads
+
+
+HTPASSWD_FILE = ".htpasswd"
 # has auth is True if users should be logged in to access the server
-HAS_AUTH = (os.path.exists(".htpasswd")  # check that password file exists ...
-            and which("htpasswd") is not None)  # ... and that program 'htpasswd' exists
+HAS_AUTH = os.path.exists(HTPASSWD_FILE)  # check that password file exists
+
+
+class Htpasswd:
+    """
+    Verifies passwords against the hashes in an htpasswd file, without spawning a process for each request.
+    The file is parsed once and parsed again when its modification time changes (checked at most every 5 seconds).
+    """
+    STAT_INTERVAL = 5
+
+    def __init__(self, path):
+        self.path = path
+        self.hashes = {}
+        self.mtime = None
+        self.last_stat = None
+
+    def _reload_if_changed(self):
+        now = time.monotonic()
+        if self.last_stat is not None and now - self.last_stat < self.STAT_INTERVAL:
+            return
+        self.last_stat = now
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError:
+            self.hashes = {}
+            self.mtime = None
+            return
+        if mtime != self.mtime:
+            hashes = {}
+            with open(self.path, "rb") as f:
+                for line in f:
+                    line = line.strip()
+                    if line and b":" in line:
+                        user, hash_ = line.split(b":", 1)
+                        hashes[user] = hash_
+            self.hashes = hashes
+            self.mtime = mtime
+
+    def verify(self, user, pwd):
+        """
+        Returns True if 'pwd' is the correct password for 'user', False if it is not,
+        and None if the password can't be verified because the hash algorithm isn't supported.
+        """
+        self._reload_if_changed()
+        hash_ = self.hashes.get(user)
+        if hash_ is None:
+            return False
+        if hash_.startswith((b"$2y$", b"$2a$", b"$2b$")):
+            if bcrypt is None:
+                return None
+            return bcrypt.checkpw(pwd, hash_)
+        if hash_.startswith(b"$apr1$"):
+            if apr_md5_crypt is None:
+                return None
+            return apr_md5_crypt.verify(pwd, hash_)
+        if hash_.startswith(b"{SHA}"):
+            return hmac.compare_digest(b"{SHA}" + b64encode(hashlib.sha1(pwd).digest()), hash_)
+        if hash_.startswith((b"$1$", b"$5$", b"$6$")):
+            try:
+                # crypt is only imported when needed, it is deprecated since Python 3.11 (and removed in 3.13)
+                with warnings.catch_warnings():
+                    warnings.simplefilter("ignore", DeprecationWarning)
+                    import crypt
+            except ImportError:
+                return None
+            try:
+                crypted = crypt.crypt(pwd.decode("utf-8"), hash_.decode("ascii"))
+            except UnicodeDecodeError:
+                return False
+            return crypted is not None and hmac.compare_digest(crypted.encode("ascii"), hash_)
+        return None
+
+    def verify_subprocess(self, user, pwd):
+        """Verifies the password using the program 'htpasswd'. Returns None if it isn't installed."""
+        if which("htpasswd") is None:
+            return None
+        try:
+            proc = subprocess.run(["htpasswd", "-i", "-v", self.path, user], timeout=1, input=pwd)
+        except subprocess.TimeoutExpired:
+            return False
+        return proc.returncode == 0
+
+
+HTPASSWD = Htpasswd(HTPASSWD_FILE)
+
 
 class BasicAuthHandler(tornado.web.RequestHandler):
     def prepare(self):
@@ -46,11 +173,14 @@ class BasicAuthHandler(tornado.web.RequestHandler):
             except Exception:
                 return request_auth()
             user, pwd = decoded.split(b":", 1)
-            try:
-                proc = subprocess.run(["htpasswd", "-i", "-v", ".htpasswd", user], timeout=1, input=pwd)
-            except subprocess.TimeoutExpired:
-                return request_auth()
-            if proc.returncode != 0:
+            if tornado.options.options.htpasswd_subprocess:
+                valid = HTPASSWD.verify_subprocess(user, pwd)
+            else:
+                valid = HTPASSWD.verify(user, pwd)
+                if valid is None:
+                    # hash algorithm not supported (or required module not installed), let 'htpasswd' check the password
+                    valid = HTPASSWD.verify_subprocess(user, pwd)
+            if not valid:
                 return request_auth()
 
 
@@ -59,212 +189,797 @@ LEDS.all_off()
 LEDS.reset()
 
 
-move_joystick = None
+# Motor/Sensor instances by port, so that sysfs doesn't have to be searched for the device on every message
 motors = {}
-old_joystick_left_port = None
-old_joystick_right_port = None
+sensors = {}
+# MoveJoystick instances by (left port, right port)
+move_joysticks = {}
 old_motor_1_port = None
 old_motor_2_port = None
 
+
+def get_device(devices, device_class, port):
+    """Returns the device of class 'device_class' on 'port' from the cache 'devices', creating it if necessary."""
+    device = devices.get(port)
+    if device is None:
+        device = devices[port] = device_class(port)
+    return device
+
+
+@contextmanager
+def forget_device_on_error(devices, port):
+    """
+    Removes the device on 'port' from the cache 'devices' if the code in the with block raises an error which shows 
+    that the device has probably been disconnected, so that it is looked up again next time.
+    """
+    try:
+        yield
+    except DeviceNotFound:
+        devices.pop(port, None)
+        raise
+    except OSError as e:
+        if is_disconnected_error(e):
+            devices.pop(port, None)
+        raise
+
+
+# errno values of errors raised when accessing the sysfs files of a device that has been disconnected
+DISCONNECTED_ERRNOS = (errno.ENODEV, errno.ENOENT)
+
+def is_disconnected_error(error):
+    """Returns True if the OSError 'error' shows that the device has been disconnected (and not e.g. an invalid value)."""
+    return error.errno in DISCONNECTED_ERRNOS
+
+
 class EV3InfoHandler(BasicAuthHandler, tornado.websocket.WebSocketHandler):
     websockets = set()
-    websockets_lock = Lock()
+    # all info that has been sent to the clients so far, merged into one object (see merge_info), or None if INFO_SENDER
+    # isn't currently polling the devices. New clients receive this instead of reading all attributes of all devices again.
+    full_info = None
+    full_info_content = None  # full_info as encoded JSON, or None if it has to be encoded again
+
+    # maximum number of messages waiting to be sent to a client, see queue_message
+    MAX_QUEUED_MESSAGES = 4
+
+    def get_compression_options(self):
+        # compressing messages costs too much CPU time on the EV3, and frames are written directly to the stream
+        # without compression (see send_queued_messages)
+        return None
 
     def open(self):
-        with EV3InfoHandler.websockets_lock:
-            EV3InfoHandler.websockets.add(self)
-        self.write_message(get_info(set(), set(), True)[0])
-        self.write_message("next")  # inform client that it is allowed to send a new message
+        # messages are small and should be sent immediately, so disable Nagle's algorithm
+        self.set_nodelay(True)
+        self.queued_messages = tornado.queues.Queue(maxsize=self.MAX_QUEUED_MESSAGES)
+        tornado.ioloop.IOLoop.current().spawn_callback(self.send_queued_messages)
+        EV3InfoHandler.websockets.add(self)
+        INFO_SENDER.start()
+        self.full_info_queued = False
+        self.queue_full_info()
+        self.queue_message(b"next")  # inform client that it is allowed to send a new message
     
     def on_close(self):
-        with EV3InfoHandler.websockets_lock:
-            EV3InfoHandler.websockets.remove(self)
+        EV3InfoHandler.websockets.remove(self)
+        if len(EV3InfoHandler.websockets) == 0:
+            INFO_SENDER.stop()
+        # stop send_queued_messages
+        while not self.queued_messages.empty():
+            self.queued_messages.get_nowait()
+        self.queued_messages.put_nowait(None)
+
+    def queue_message(self, message, frame=None, overridable=False):
+        """
+        Queues the UTF-8 encoded text message 'message' to be sent to this client. 'frame' may be the message already 
+        encoded as a websocket frame (see _encode_frame), binary messages must be passed as a frame.
+        If 'overridable' is True, 'message' only contains changes that are also included in full_info. If the client 
+        is behind, i.e. other messages are still waiting to be sent, such messages aren't queued. Instead, full_info 
+        is sent once the client has caught up, so that it receives a single message containing the newest values.
+        """
+        if overridable and not self.queued_messages.empty():
+            self.queue_full_info()
+        else:
+            self._put_message((message, frame))
+
+    def queue_full_info(self):
+        """Queues full_info to be sent to this client, unless it is already waiting to be sent."""
+        if not self.full_info_queued:
+            self.full_info_queued = True
+            # the content is only determined when the message is sent, so that it includes all changes up to then
+            self._put_message((None, None))
+
+    def _put_message(self, item):
+        """
+        Adds 'item' to the queue. If too many messages are waiting, they are all dropped and replaced by full_info 
+        (and "next", if it was dropped), so that a slow client can't fill up the memory.
+        """
+        try:
+            self.queued_messages.put_nowait(item)
+        except tornado.queues.QueueFull:
+            send_next = item[0] == b"next"
+            while not self.queued_messages.empty():
+                if self.queued_messages.get_nowait()[0] == b"next":
+                    send_next = True
+            # all other messages only contain changes that are included in full_info
+            self.full_info_queued = True
+            self.queued_messages.put_nowait((None, None))
+            if send_next:
+                self.queued_messages.put_nowait((b"next", None))
+
+    async def send_queued_messages(self):
+        """Sends queued messages one after the other, waiting until each one has been written to the socket."""
+        while True:
+            item = await self.queued_messages.get()
+            if item is None:
+                return
+            message, frame = item
+            if message is None:
+                self.full_info_queued = False
+                message = EV3InfoHandler.get_full_info_content()
+            connection = self.ws_connection
+            # the frame is written directly to the stream, so check that no close frame has been sent or received 
+            # yet, as write_message would
+            if connection is None or connection.is_closing():
+                return
+            try:
+                await connection.stream.write(frame or self._encode_frame(message))
+            except (tornado.websocket.WebSocketClosedError, StreamClosedError):
+                return
+            except Exception:
+                traceback.print_exc()
 
     def on_message(self, messages):
-        global move_joystick
         try:
             print("got messages", messages)
-            for message in json.loads(messages):
+            for message in json_loads(messages):
                 type_ = message["type"]
                 if type_ == "rc-joystick":
-                    if message["leftPort"] != old_joystick_left_port or message["rightPort"] != old_joystick_right_port:
-                        move_joystick = MoveJoystick(message["leftPort"], message["rightPort"])
-                    if message["x"] == 0 and message["y"] == 0:
-                        move_joystick.off(brake=False)
-                    else:
-                        move_joystick.on(message["x"], message["y"], 1)
+                    ports = (message["leftPort"], message["rightPort"])
+                    with forget_device_on_error(move_joysticks, ports):
+                        move_joystick = get_device(move_joysticks, lambda ports: MoveJoystick(*ports), ports)
+                        if message["x"] == 0 and message["y"] == 0:
+                            move_joystick.off(brake=False)
+                        else:
+                            move_joystick.on(message["x"], message["y"], 1)
                 elif type_ == "rc-motor":
-                    if message["port"] in motors:
-                        motor = motors[message["port"]]
-                    else:
-                        motor = motors[message["port"]] = Motor(message["port"])
-                    motor.on(message["speed"]*100)
+                    port = message["port"]
+                    with forget_device_on_error(motors, port):
+                        get_device(motors, Motor, port).on(message["speed"]*100)
                 elif type_ == "sensor":
                     port = message["port"]
                     attributes = message["attributes"]
-                    device = Sensor(port)
-                    for name, value in attributes.items():
-                        setattr(device, name, value)
-                    # send changes to other clients
-                    EV3InfoHandler.send_to_all(json.dumps({port: attributes}), {self})
+                    with forget_device_on_error(sensors, port):
+                        attributes = write_attributes(get_device(sensors, Sensor, port), attributes, WRITABLE_SENSOR_ATTRIBUTES)
+                    self.send_changes(port, attributes)
                 elif type_ == "motor":
                     port = message["port"]
                     attributes = message["attributes"]
-                    device = Motor(port)
-                    for name, value in attributes.items():
-                        setattr(device, name, value)
-                    # send changes to other clients
-                    EV3InfoHandler.send_to_all(json.dumps({port: attributes}), {self})
+                    with forget_device_on_error(motors, port):
+                        attributes = write_attributes(get_device(motors, Motor, port), attributes, WRITABLE_MOTOR_ATTRIBUTES)
+                    self.send_changes(port, attributes)
                 elif type_ == "led":
                     port = message["port"]
                     attributes = message["attributes"]
                     led_group = port.split(":")[1].lower()
                     for color_name, brightness in attributes.items():
                         LEDS.leds[color_name + "_" + led_group].brightness_pct = float(brightness)
-                    # send changes to other clients
-                    EV3InfoHandler.send_to_all(json.dumps({port: attributes}), {self})
+                    self.send_changes(port, attributes)
                 else:
                     raise ValueError("Unknown message type '" + type_ + "'")
         except Exception:
             traceback.print_exc()
-        self.send_to_all("next")
+        self.send_to_all(b"next")
     
+    def send_changes(self, port, attributes):
+        """Sends attribute changes made by this client to all other clients."""
+        if EV3InfoHandler.full_info is not None:
+            merge_info(EV3InfoHandler.full_info, {port: attributes}, only_known=True)
+            EV3InfoHandler.full_info_content = None
+        EV3InfoHandler.send_to_all(json_dumps({port: attributes}), {self}, overridable=True)
+
     @classmethod
-    def send_to_all(cls, message, exclude_websockets=None):
-        with cls.websockets_lock:
-            for websocket in cls.websockets:
-                if not exclude_websockets or websocket not in exclude_websockets:
-                    try:
-                        websocket.write_message(message)
-                    except Exception:
-                        traceback.print_exc()
-
-
-"""
-Returns a string containing a JSON object which describes the current motor/sensor values in the following format:
-    {
-        "<address (e.g. "ev3-ports:in1")>": {
-            // for both sensors and motors:
-            "driver_name": "<driver name>",
-            "command": [<list of possible commands>],
-            // for sensors:
-            "values": "<current sensor values, separated by space (max. 8)>",
-            "mode": {
-                "selected": "<currently selected mode>],
-                "values": [<list of possible modes>]
-            },
-            // for motors:
-            "position": "<current motor position>",
-            "duty_cycle_sp": "<duty cycle setpoint>",
-            "polarity": "normal" or "inversed",
-            "position_sp": "position setpoint",
-            "speed_sp": "speed setpoint",
-            "ramp_up_sp": "ramp up setpoint",
-            "ramp_down_sp": "ramp down setpoint",
-            "stop_action": {
-                "selected": "<currently selected stop_action>",
-                "values": [<list of possible stop_actions>]
-            },
-            "time_sp": "time setpoint",
+    def get_full_info_content(cls):
+        """Returns the encoded JSON object containing all info a newly connected client needs."""
+        if cls.full_info is None:
+            # no tick has happened yet since the first client connected
+            INFO_SENDER.read_full_info()
+        if cls.full_info_content is None:
+            cls.full_info_content = json_dumps(cls.full_info)
+        return cls.full_info_content
+
+    @classmethod
+    def send_to_all(cls, message, exclude_websockets=None, overridable=False, binary=False):
+        """
+        Sends 'message' as a text message (or a binary message if 'binary' is True) to all websockets except those in 
+        'exclude_websockets'. Text messages should already be encoded as UTF-8, so that they are not encoded again 
+        for each client. See queue_message for 'overridable'.
+        """
+        websockets = cls.websockets
+        if exclude_websockets:
+            websockets = [websocket for websocket in websockets if websocket not in exclude_websockets]
+        # the frame is the same for all clients, so only build it once
+        frame = cls._encode_frame(message, binary)
+        for websocket in websockets:
+            websocket.queue_message(message, frame, overridable)
+
+    @staticmethod
+    def _encode_frame(payload, binary=False):
+        """
+        Returns a complete, unmasked websocket text frame (or binary frame if 'binary' is True), as sent from server 
+        to client, containing 'payload'.
+        """
+        first_byte = 0x82 if binary else 0x81  # FIN bit and opcode
+        length = len(payload)
+        if length < 126:
+            header = struct.pack("!BB", first_byte, length)
+        elif length <= 0xFFFF:
+            header = struct.pack("!BBH", first_byte, 126, length)
+        else:
+            header = struct.pack("!BBQ", first_byte, 127, length)
+        return header + payload
+
+
+class AttributeCache:
+    """
+    Keeps the sysfs attribute files of devices open, so that polling an attribute only needs a single pread() call
+    instead of the open()/read()/close() done by ev3dev2 for each access. The same applies to pwrite() for writing.
+    File descriptors are stored by (sysfs path of the device, attribute name), separately for reading and writing, 
+    because some attributes (e.g. 'command') can only be written.
+    """
+    def __init__(self):
+        self.fds = {}
+        self.write_fds = {}
+
+    @staticmethod
+    def _access(fds, flags, function, device, name, *args):
+        key = (device._path, name)
+        fd = fds.get(key)
+        if fd is None:
+            fd = fds[key] = os.open(os.path.join(device._path, name), flags)
+        try:
+            return function(fd, *args)
+        except OSError as e:
+            if is_disconnected_error(e):
+                del fds[key]
+                os.close(fd)
+            raise
+
+    def read(self, device, name, size=32):
+        """Reads at most 'size' bytes from the sysfs attribute 'name' of 'device'."""
+        return self._access(self.fds, os.O_RDONLY, os.pread, device, name, size, 0)
+
+    def write(self, device, name, value):
+        """Writes the bytes 'value' to the sysfs attribute 'name' of 'device'."""
+        self._access(self.write_fds, os.O_WRONLY, os.pwrite, device, name, value, 0)
+
+    def read_int(self, device, name):
+        return int(self.read(device, name))
+
+    def read_str(self, device, name):
+        return self.read(device, name).decode().strip()
+
+    def forget(self, connected_paths):
+        """Closes the files of all devices whose sysfs path is not in 'connected_paths'."""
+        for fds in (self.fds, self.write_fds):
+            for key in [key for key in fds if key[0] not in connected_paths]:
+                os.close(fds.pop(key))
+
+
+ATTRIBUTES = AttributeCache()
+
+
+def write_attributes(device, attributes, writable_names):
+    """
+    Writes 'attributes' (a dict of attribute names and values, as sent by a client) to the sysfs attributes of 
+    'device' using ATTRIBUTES, and returns a dict of the values as they were written. Values of NUMERIC_ATTRIBUTES 
+    are converted with int(), like ev3dev2 does. 'command' is written last, so that a command is run with the other 
+    attributes that were sent together with it.
+    Nothing is written if one of the attributes isn't in 'writable_names' or one of the values is invalid (e.g. 
+    empty), in this case ValueError is raised.
+    """
+    converted = {}
+    for name, value in attributes.items():
+        if name not in writable_names:
+            raise ValueError("Attribute '" + name + "' can't be changed")
+        if name in NUMERIC_ATTRIBUTES:
+            value = int(value)
+        elif value is None or value == "":
+            raise ValueError("No value given for attribute '" + name + "'")
+        converted[name] = value
+    for name in sorted(converted, key=lambda name: name == "command"):
+        ATTRIBUTES.write(device, name, str(converted[name]).encode())
+    return converted
+
+
+# names of the files containing the values of a sensor, sensors have at most 8 values
+VALUE_ATTRIBUTES = tuple("value" + str(i) for i in range(8))
+
+def read_sensor_values(sensor):
+    """
+    Returns a tuple containing the current values of 'sensor', as integers like ev3dev2's Sensor.value().
+    The 'value<n>' files are read instead of 'bin_data', because 'bin_data' contains the unscaled raw values.
+    """
+    num_values = ATTRIBUTES.read_int(sensor, "num_values")
+    return tuple(ATTRIBUTES.read_int(sensor, name) for name in VALUE_ATTRIBUTES[:num_values])
+
+
+_sensor_address_cache = {}
+
+def get_sensor_address(sensor):
+    """
+    Returns the address of 'sensor' (without the ':i2c*' suffix of i2c sensors).
+    The address doesn't change while a sensor is connected, so it is cached by the sensor's sysfs path.
+    """
+    path = sensor._path
+    address = _sensor_address_cache.get(path)
+    if address is None:
+        address = sensor.address
+        if address.count(":") > 1:
+            # addresses for i2c sensors end with ':i2c*', remove this
+            address = address[:address.index(":", address.index(":")+1)]
+        _sensor_address_cache[path] = address
+    return address
+
+
+# attributes that don't change while a device is connected
+STATIC_SENSOR_ATTRIBUTES = ("driver_name", "modes", "commands")
+STATIC_MOTOR_ATTRIBUTES = ("address", "driver_name", "stop_actions", "commands")
+_static_attributes_cache = {}
+
+def get_static_attributes(device, names):
+    """
+    Returns a dict containing the values of the attributes 'names' of 'device', which must not change while the device 
+    is connected. They are only read once per device and cached by the device's sysfs path.
+    """
+    attributes = _static_attributes_cache.get(device._path)
+    if attributes is None:
+        attributes = _static_attributes_cache[device._path] = {name: getattr(device, name) for name in names}
+    return attributes
+
+
+def forget_devices(connected_paths):
+    """Removes cached data of all devices whose sysfs path is not in 'connected_paths', i.e. that have been disconnected."""
+    for cache in (_sensor_address_cache, _static_attributes_cache, _last_error_times):
+        for path in set(cache).difference(connected_paths):
+            del cache[path]
+    ATTRIBUTES.forget(connected_paths)
+
+
+class DeviceList:
+    """
+    Keeps the connected sensors and motors, so that their directories in /sys/class don't have to be scanned on every 
+    tick. If pyudev is available, the devices are only listed again when udev reports that a sensor or motor was added 
+    or removed, otherwise they are listed whenever they are requested.
+    """
+    def __init__(self):
+        self.monitor = None
+        self.invalidate()
+
+    def start(self):
+        """Starts listening for udev events on the current IOLoop, if pyudev is available and it isn't listening yet."""
+        if pyudev is None or self.monitor is not None:
+            return
+        try:
+            monitor = pyudev.Monitor.from_netlink(pyudev.Context())
+            monitor.filter_by("lego-sensor")
+            monitor.filter_by("tacho-motor")
+            monitor.start()
+        except Exception:
+            traceback.print_exc()
+            return
+        self.monitor = monitor
+        tornado.ioloop.IOLoop.current().add_handler(monitor.fileno(), self.on_udev_event, tornado.ioloop.IOLoop.READ)
+        # devices may have changed before the monitor was started
+        self.invalidate()
+
+    def on_udev_event(self, fd, events):
+        while self.monitor.poll(timeout=0) is not None:
+            pass
+        self.invalidate()
+
+    def invalidate(self):
+        """Makes get() list the devices again, e.g. after reading from one of them failed."""
+        self.sensors = None
+        self.motors = None
+
+    def get(self):
+        """Returns a tuple (sensors, motors) containing lists of the connected devices."""
+        if self.sensors is None or self.monitor is None:
+            self.sensors = list(list_sensors("*"))
+            self.motors = list(list_motors("*"))
+        return self.sensors, self.motors
+
+
+DEVICES = DeviceList()
+
+
+# maps device addresses to ids, which identify devices in binary messages (see encode_values)
+ADDRESS_IDS = {}
+
+def get_address_id(address):
+    return ADDRESS_IDS.setdefault(address, len(ADDRESS_IDS))
+
+
+# binary messages start with the message type and the number of entries
+BINARY_MESSAGE_HEADER = struct.Struct("<BH")
+VALUES_MESSAGE = 1
+# each entry of a VALUES_MESSAGE starts with the address id, the kind of values and their number, followed by the values
+VALUES_ENTRY_HEADER = struct.Struct("<HBB")
+MOTOR_POSITION = 0  # a single int32
+SENSOR_VALUES = 1  # int32s
+
+def encode_values(info):
+    """
+    Removes all devices from 'info' whose info only consists of sensor values or a motor position, i.e. those that are 
+    sent on every tick, and returns them encoded as a binary VALUES_MESSAGE, or None if there are no such devices.
+    Clients learn the address ids from the "id" attribute included in the info they receive for new devices.
+    """
+    entries = []
+    for address in [address for address, attributes in info.items() if address in ADDRESS_IDS and len(attributes) == 1]:
+        attributes = info[address]
+        if "position" in attributes:
+            entries.append(VALUES_ENTRY_HEADER.pack(ADDRESS_IDS[address], MOTOR_POSITION, 1)
+                           + struct.pack("<i", attributes["position"]))
+        elif "values" in attributes:
+            values = attributes["values"]
+            entries.append(VALUES_ENTRY_HEADER.pack(ADDRESS_IDS[address], SENSOR_VALUES, len(values))
+                           + struct.pack("<%di" % len(values), *values))
+        else:
+            continue
+        del info[address]
+    if not entries:
+        return None
+    return BINARY_MESSAGE_HEADER.pack(VALUES_MESSAGE, len(entries)) + b"".join(entries)
+
+
+# attributes of motors that are sent to clients as they are when they first see a motor
+MOTOR_ATTRIBUTES = ("duty_cycle_sp", "polarity", "position", "position_sp", "speed_sp",
+                    "ramp_up_sp", "ramp_down_sp", "time_sp")
+# attributes that clients may change (see write_attributes)
+WRITABLE_SENSOR_ATTRIBUTES = {"mode", "command"}
+WRITABLE_MOTOR_ATTRIBUTES = set(MOTOR_ATTRIBUTES).union(("stop_action", "command"))
+# attributes whose values are integers
+NUMERIC_ATTRIBUTES = set(MOTOR_ATTRIBUTES).difference(("polarity",))
+
+
+# executor that reads the values of several devices in parallel in collect_info, or None to read them one after another
+READ_EXECUTOR = None
+
+def read_in_parallel(reads):
+    """
+    Calls each function in 'reads' (a list of (function, device) tuples) with its device, using READ_EXECUTOR if it is 
+    set, and returns a list of the results. If a call raises an exception, the exception is returned as its result.
+    """
+    def call(read):
+        function, device = read
+        try:
+            return function(device)
+        except Exception as e:
+            return e
+    if READ_EXECUTOR is None or len(reads) < 2:
+        return [call(read) for read in reads]
+    return list(READ_EXECUTOR.map(call, reads))
+
+
+# tracebacks of errors while reading a device are printed at most once per this many seconds and device
+ERROR_PRINT_INTERVAL = 1
+_last_error_times = {}
+
+def print_device_error(device, error=None):
+    """
+    Prints the traceback of 'error', or of the exception currently being handled if it is None, unless one has been 
+    printed for 'device' within the last ERROR_PRINT_INTERVAL seconds, so that a device that fails on every tick 
+    doesn't flood the output (and slow down polling with formatting tracebacks).
+    """
+    now = time.monotonic()
+    last_error_time = _last_error_times.get(device._path)
+    if last_error_time is not None and now - last_error_time < ERROR_PRINT_INTERVAL:
+        return
+    _last_error_times[device._path] = now
+    if error is None:
+        traceback.print_exc()
+    else:
+        traceback.print_exception(type(error), error, error.__traceback__)
+
+
+def read_motor_position(motor):
+    return ATTRIBUTES.read_int(motor, "position")
+
+
+def collect_info(old_sensor_addresses, old_motor_addresses, all_info=False):
+    """
+    Returns a tuple (info, sensor addresses, motor addresses). 'info' is a dict which describes the current 
+    motor/sensor values in the following format:
+        {
+            "disconnected_devices": [<addresses of devices that have been disconnected>],
+            "<address (e.g. "ev3-ports:in1")>": {
+                // for both sensors and motors:
+                "id": <id of the address in binary messages>,
+                "driver_name": "<driver name>",
+                "command": [<list of possible commands>],
+                // for sensors:
+                "values": [<current sensor values (max. 8)>],
+                "mode": {
+                    "selected": "<currently selected mode>",
+                    "values": [<list of possible modes>]
+                },
+                // for motors:
+                "position": <current motor position>,
+                "duty_cycle_sp": <duty cycle setpoint>,
+                "polarity": "normal" or "inversed",
+                "position_sp": <position setpoint>,
+                "speed_sp": <speed setpoint>,
+                "ramp_up_sp": <ramp up setpoint>,
+                "ramp_down_sp": <ramp down setpoint>,
+                "stop_action": {
+                    "selected": "<currently selected stop_action>",
+                    "values": [<list of possible stop_actions>]
+                },
+                "time_sp": <time setpoint>
+            }
         }
-    }
-Parameters 'old_sensor_addressse' and 'old_motor_addresses' are sets of previously available adresses. 
-If an address was previously available, only "values" attribute (for sensors) or "position" attribute (for motors) is included.
-This is because these are the only properties that change while the user views the page. 
-If 'all_info' is True, additional info is added that clients need when they connect for the first time: Currently, this is only LED brightnesses. 
-When a WebSocket first connects with the server, get_info(set(), set()) is called so that initially the client receives all attributes (see EV3InfoHandler.open). 
-
-get_info returns: (string containing JSON object, new sensor addresses (for use in the next call of get_info), new motor addresses (for use in the next call of get_info)).
-"""
-def get_info(old_sensor_addresses, old_motor_addresses, all_info=False):
+    Parameters 'old_sensor_addresses' and 'old_motor_addresses' are sets of previously available addresses, the 
+    returned sets of addresses are meant to be passed to the next call. 
+    If an address was previously available, only the "values" attribute (for sensors) or the "position" attribute 
+    (for motors) is included, because these are the only properties that change while the user views the page. 
+    If 'all_info' is True, additional info is added that clients need when they connect for the first time: 
+    Currently, this is only LED brightnesses. 
+    When the first WebSocket connects with the server, collect_info(set(), set(), True) is called so that initially 
+    the client receives all attributes (see InfoSender.read_full_info).
+    """
     info = {"disconnected_devices": []}
     if all_info:
         for group_name, leds in LEDS.led_groups.items():
             info["led:" + group_name] = {led.desc.split("_")[0]: led.brightness_pct for led in leds}
+    sensors, motors = DEVICES.get()
     sensor_addresses = set()
-    for sensor in list_sensors("*"):
+    motor_addresses = set()
+    device_paths = set()
+    # values of already known devices, which are read together (see read_in_parallel), as 
+    # (address, attribute name, addresses set, (function, device))
+    reads = []
+    for sensor in sensors:
         try:
-            address = sensor.address
-            if address.count(":") > 1:
-                # addresses for i2c sensors end with ':i2c*', remove this
-                address = address[:address.index(":", address.index(":")+1)]
+            device_paths.add(sensor._path)
+            address = get_sensor_address(sensor)
             if address in old_sensor_addresses:
                 old_sensor_addresses.remove(address)
-                info[address] = {
-                    "values": " ".join(str(sensor.value(i)) for i in range(sensor.num_values))
-                }
-            else:
-                info[address] = {
-                    "driver_name": sensor.driver_name,
-                    "mode": {
-                        "values": sensor.modes,
-                        "selected": sensor.mode
-                    },
-                    "command": sensor.commands,
-                    "values": " ".join(str(sensor.value(i)) for i in range(sensor.num_values)),
-                    #"decimals": sensor.decimals,
-                }
+                reads.append((address, "values", sensor_addresses, (read_sensor_values, sensor)))
+                continue
+            static_attributes = get_static_attributes(sensor, STATIC_SENSOR_ATTRIBUTES)
+            info[address] = {
+                "id": get_address_id(address),
+                "driver_name": static_attributes["driver_name"],
+                "mode": {
+                    "values": static_attributes["modes"],
+                    "selected": sensor.mode
+                },
+                "command": static_attributes["commands"],
+                "values": read_sensor_values(sensor),
+                #"decimals": sensor.decimals,
+            }
             sensor_addresses.add(address)
         except Exception:
-            traceback.print_exc()
-    info["disconnected_devices"].extend(old_sensor_addresses)
-    motor_addresses = set()
-    for motor in list_motors("*"):
+            print_device_error(sensor)
+            # the sensor has probably been disconnected
+            DEVICES.invalidate()
+    for motor in motors:
         try:
-            address = motor.address
+            device_paths.add(motor._path)
+            static_attributes = get_static_attributes(motor, STATIC_MOTOR_ATTRIBUTES)
+            address = static_attributes["address"]
             if address in old_motor_addresses:
                 old_motor_addresses.remove(address)
-                info[address] = {
-                    "position": motor.position
-                }
-            else:
-                info[address] = {
-                    "driver_name": motor.driver_name,
-                    "duty_cycle_sp": motor.duty_cycle_sp,
-                    "polarity": motor.polarity,
-                    "position": motor.position,
-                    "position_sp": motor.position_sp,
-                    "speed_sp": motor.speed_sp,
-                    "ramp_up_sp": motor.ramp_up_sp,
-                    "ramp_down_sp": motor.ramp_down_sp,
-                    "stop_action": {
-                        "values": motor.stop_actions,
-                        "selected": motor.stop_action
-                    },
-                    "time_sp": motor.time_sp,
-                    "command": motor.commands
-                }
+                reads.append((address, "position", motor_addresses, (read_motor_position, motor)))
+                continue
+            motor_info = info[address] = {
+                "id": get_address_id(address),
+                "driver_name": static_attributes["driver_name"]
+            }
+            for name in MOTOR_ATTRIBUTES:
+                motor_info[name] = getattr(motor, name)
+            motor_info["stop_action"] = {
+                "values": static_attributes["stop_actions"],
+                "selected": motor.stop_action
+            }
+            motor_info["command"] = static_attributes["commands"]
             motor_addresses.add(address)
         except Exception:
-            traceback.print_exc()
+            print_device_error(motor)
+            DEVICES.invalidate()
+    for (address, name, addresses, (_, device)), value in zip(reads, read_in_parallel([read[3] for read in reads])):
+        if isinstance(value, Exception):
+            print_device_error(device, value)
+            DEVICES.invalidate()
+            continue
+        info[address] = {name: value}
+        addresses.add(address)
+    info["disconnected_devices"].extend(old_sensor_addresses)
     info["disconnected_devices"].extend(old_motor_addresses)
-    content = json.dumps(info).encode("utf-8")
-    return content, sensor_addresses, motor_addresses
+    forget_devices(device_paths)
+    return info, sensor_addresses, motor_addresses
 
 
-def send_info():
-    old_sensor_addresses = set()
-    old_motor_addresses = set()
-    while True:
-        if len(EV3InfoHandler.websockets) == 0:
-            print("Waiting for clients to connect...")
-            while len(EV3InfoHandler.websockets) == 0:
-                time.sleep(0.5)
+def merge_info(full_info, info, only_known=False):
+    """
+    Merges 'info' (a dict in the format returned by collect_info, without "disconnected_devices") into 'full_info'.
+    Devices with all attributes (i.e. those including "driver_name") replace the ones in 'full_info', for other devices, 
+    only the given attributes are updated. If 'only_known' is True, devices that aren't in 'full_info' are ignored.
+    """
+    for address, attributes in info.items():
+        known_attributes = full_info.get(address)
+        if known_attributes is None or "driver_name" in attributes:
+            if not only_known:
+                full_info[address] = dict(attributes)
+            continue
+        for name, value in attributes.items():
+            known_value = known_attributes.get(name)
+            if isinstance(known_value, dict):
+                # e.g. the selected mode of a sensor
+                known_attributes[name] = dict(known_value, selected=value)
+            elif not isinstance(known_value, list):  # lists (e.g. commands) don't change when a value is sent
+                known_attributes[name] = value
+
+
+class InfoSender:
+    """
+    Sends the changed motor/sensor values to all clients every 'interval' milliseconds, using a PeriodicCallback 
+    on the IOLoop. Devices are only polled while clients are connected, see start() and stop().
+    Unchanged values are not sent, except every 'refresh_interval' seconds, when all current values are sent again.
+    """
+    def __init__(self, interval=100, refresh_interval=2):
+        self.callback = tornado.ioloop.PeriodicCallback(self.tick, interval)
+        self.refresh_interval = refresh_interval
+        self.reset()
+
+    def reset(self):
+        self.old_sensor_addresses = set()
+        self.old_motor_addresses = set()
+        self.old_info = {}
+        self.last_refresh = time.monotonic()
+        EV3InfoHandler.full_info = None
+        EV3InfoHandler.full_info_content = None
+
+    def start(self):
+        """Starts polling if it isn't running yet, called when a client connects."""
+        if not self.callback.is_running():
             print("Clients connected!")
-        content, old_sensor_addresses, old_motor_addresses = get_info(old_sensor_addresses, old_motor_addresses)
-        EV3InfoHandler.send_to_all(content)
-        time.sleep(0.1)
+            DEVICES.start()
+            self.callback.start()
+
+    def stop(self):
+        """Stops polling, called when the last client disconnects."""
+        self.callback.stop()
+        # devices aren't polled while no client is connected, so start over once clients connect
+        self.reset()
+        print("Waiting for clients to connect...")
+
+    def read_full_info(self):
+        """
+        Reads all info of all devices into EV3InfoHandler.full_info, called when the first client needs it before 
+        the first tick. The following ticks then only read and send what changed.
+        """
+        self.old_info = self.update_full_info()[0]
+
+    def update_full_info(self):
+        """
+        Reads the devices (all their info if full_info is None, otherwise only their values) and merges the info into 
+        EV3InfoHandler.full_info. Returns a tuple (info, list of disconnected devices).
+        """
+        info, self.old_sensor_addresses, self.old_motor_addresses = collect_info(
+            self.old_sensor_addresses, self.old_motor_addresses, EV3InfoHandler.full_info is None)
+        disconnected_devices = info.pop("disconnected_devices")
+        if EV3InfoHandler.full_info is None:
+            EV3InfoHandler.full_info = {}
+        merge_info(EV3InfoHandler.full_info, info)
+        for address in disconnected_devices:
+            EV3InfoHandler.full_info.pop(address, None)
+        # keep track of disconnected devices, so that clients that receive full_info after they dropped messages 
+        # (see EV3InfoHandler.queue_message) know about them
+        EV3InfoHandler.full_info["disconnected_devices"] = [
+            address for address in set(EV3InfoHandler.full_info.get("disconnected_devices", ())).union(disconnected_devices)
+            if address not in EV3InfoHandler.full_info
+        ]
+        return info, disconnected_devices
+
+    def tick(self):
+        info, disconnected_devices = self.update_full_info()
+        now = time.monotonic()
+        if now - self.last_refresh >= self.refresh_interval:
+            self.last_refresh = now
+            delta = dict(info)
+        else:
+            # only send devices whose attributes changed since the last broadcast
+            delta = {address: attributes for address, attributes in info.items() if self.old_info.get(address) != attributes}
+        if disconnected_devices:
+            delta["disconnected_devices"] = disconnected_devices
+        self.old_info = info
+        if delta:
+            EV3InfoHandler.full_info_content = None
+            values = encode_values(delta)
+            if delta:
+                EV3InfoHandler.send_to_all(json_dumps(delta), overridable=True)
+            if values is not None:
+                EV3InfoHandler.send_to_all(values, overridable=True, binary=True)
+
+
+INFO_SENDER = InfoSender()
+
+
+# static files with these extensions are sent compressed (see compress_static_files)
+COMPRESSED_EXTENSIONS = (".html", ".js", ".css")
+
+def compress_static_files(directory):
+    """
+    Creates a gzip-compressed copy ("<name>.gz") of all files in 'directory' with one of COMPRESSED_EXTENSIONS, unless 
+    an up-to-date copy already exists. This is done once at startup, so that files aren't compressed for each request.
+    """
+    for name in os.listdir(directory):
+        if not name.endswith(COMPRESSED_EXTENSIONS):
+            continue
+        path = os.path.join(directory, name)
+        try:
+            if is_compressed_copy_up_to_date(path):
+                continue
+            with open(path, "rb") as file:
+                content = gzip.compress(file.read(), 9)
+            with open(path + ".gz", "wb") as file:
+                file.write(content)
+        except OSError:
+            traceback.print_exc()
+
+
+def is_compressed_copy_up_to_date(path):
+    """Returns True if the compressed copy of the file 'path' exists and isn't older than the file."""
+    try:
+        return os.path.getmtime(path + ".gz") >= os.path.getmtime(path)
+    except OSError:
+        return False
 
 
 class StaticFiles(BasicAuthHandler, tornado.web.StaticFileHandler):
+    """
+    Serves the website, using the compressed copies of files created by compress_static_files if possible. Files that 
+    have been changed since they were compressed are sent uncompressed until the server is restarted.
+    """
+    gzipped = False
+
     def set_extra_headers(self, path):
         self.set_header("Cache-Control", "no-store, no-cache, must-revalidate, max-age=0")
+        self.set_header("Vary", "Accept-Encoding")
+
+    def validate_absolute_path(self, root, absolute_path):
+        absolute_path = super().validate_absolute_path(root, absolute_path)
+        if (absolute_path is not None and "gzip" in self.request.headers.get("Accept-Encoding", "")
+                and is_compressed_copy_up_to_date(absolute_path)):
+            self.gzipped = True
+            self.set_header("Content-Encoding", "gzip")
+            # validate the compressed file as well, so that its size is sent as Content-Length
+            return super().validate_absolute_path(root, absolute_path + ".gz")
+        return absolute_path
+
+    def get_content_type(self):
+        if self.gzipped:
+            # the type of the uncompressed file, not application/gzip
+            mime_type, _ = mimetypes.guess_type(self.absolute_path[:-len(".gz")])
+            if mime_type is not None:
+                return mime_type
+        return super().get_content_type()
 
 
 if __name__ == "__main__":
     tornado.options.define("port", default=8000, help="run on the given port", type=int)
+    tornado.options.define("htpasswd_subprocess", default=False, type=bool,
+                           help="verify passwords by running 'htpasswd' instead of checking the hashes directly")
+    tornado.options.define("read_threads", default=0, type=int,
+                           help="number of threads used to read sensor values and motor positions in parallel, "
+                                "0 reads them one after another")
     tornado.options.parse_command_line()
+    if tornado.options.options.read_threads > 0:
+        READ_EXECUTOR = ThreadPoolExecutor(tornado.options.options.read_threads)
+    if uvloop is not None:
+        # uvloop's event loop needs less CPU time per message than asyncio's default one, tornado runs on top of it
+        uvloop.install()
     static_files = os.path.join(os.path.dirname(__file__), "website")
+    compress_static_files(static_files)
     app = tornado.web.Application([
             (r"/ev3-info", EV3InfoHandler),
             (r"/(.*)", StaticFiles, {"path": static_files, "default_filename": "index.html"})
@@ -275,6 +990,5 @@ if __name__ == "__main__":
     print("Serving on port", tornado.options.options.port)
     if HAS_AUTH:
         print("Basic auth is required when connecting")
-    ioloop = tornado.ioloop.IOLoop.current()
-    Thread(target=ioloop.start).start()
-    Thread(target=send_info).start()
+    print("Waiting for clients to connect...")
+    tornado.ioloop.IOLoop.current().start()
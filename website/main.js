@@ -362,6 +362,10 @@ class MotorPositionAttributeSetter extends AttributeSetter {
 class SensorValuesAttributeSetter extends AttributeSetter {
     set(value) {
         if (value != null) {
+            if (Array.isArray(value)) {
+                // values are sent as an array of numbers
+                value = value.join(" ");
+            }
             let translated = value;
             try {
                 // translate values of some sensors into something more human-readable
@@ -575,6 +579,49 @@ window.onload = () => {
 
     /** @type {Object.<string, Device>} Maps port names to devices.  */
     const devices = {};
+    /** @type {Object.<number, string>} Maps the ids used in binary messages to port names. */
+    const portsById = {};
+
+    // binary messages start with the message type and the number of entries
+    const VALUES_MESSAGE = 1;
+    // kinds of values in a VALUES_MESSAGE entry
+    const MOTOR_POSITION = 0;
+    const SENSOR_VALUES = 1;
+
+    /**
+     * Handles a binary message, which contains the current sensor values and motor positions in this format (little-endian):
+     * uint8 message type (VALUES_MESSAGE), uint16 number of entries, then for each entry:
+     * uint16 id, uint8 kind of values, uint8 number of values, followed by the values (int32).
+     * @param {ArrayBuffer} buffer
+     */
+    function handleBinaryMessage(buffer) {
+        const view = new DataView(buffer);
+        if (view.getUint8(0) !== VALUES_MESSAGE) {
+            console.error("Unknown binary message type", view.getUint8(0));
+            return;
+        }
+        const numEntries = view.getUint16(1, true);
+        let offset = 3;
+        for (let i = 0; i < numEntries; i++) {
+            const port = portsById[view.getUint16(offset, true)];
+            const kind = view.getUint8(offset + 2);
+            const numValues = view.getUint8(offset + 3);
+            offset += 4;
+            const values = [];
+            for (let j = 0; j < numValues; j++) {
+                values.push(view.getInt32(offset, true));
+                offset += 4;
+            }
+            if (port === undefined || devices[port] === undefined) {
+                continue;
+            }
+            if (kind === MOTOR_POSITION) {
+                devices[port].updateValues({ "position": values[0] });
+            } else if (kind === SENSOR_VALUES) {
+                devices[port].updateValues({ "values": values });
+            }
+        }
+    }
 
 
     // ====================
@@ -596,13 +643,16 @@ window.onload = () => {
     let hasReceivedNext = false;
 
     if (ws != null) {
+        ws.binaryType = "arraybuffer";
         ws.addEventListener("open", event => console.log("websocket opened", event));
         ws.addEventListener("close", event => {
             console.log("WebSocket closed", event);
             ALERT_WEBSOCKET_CLOSED.hidden = false;
         });
         ws.addEventListener("message", event => {
-            if (event.data === "next") {
+            if (event.data instanceof ArrayBuffer) {
+                handleBinaryMessage(event.data);
+            } else if (event.data === "next") {
                 hasReceivedNext = false;
                 // server sends "next" to tell client that client can now send updates because the server is finished processing updates
                 let messages = [];
@@ -632,6 +682,11 @@ window.onload = () => {
                             devices[disconnectedPort].onDeviceDisconnected();
                         }
                     } else {
+                        if (deviceData.id !== undefined) {
+                            // the id identifies the device in binary messages
+                            portsById[deviceData.id] = port;
+                            delete deviceData.id;
+                        }
                         devices[port].updateValues(deviceData);
                     }
                 }